@@ -2,92 +2,381 @@
 Browser Manager untuk Autonomous Agent
 """
 import asyncio
+import logging
 import os
-from typing import Optional, Dict, Any
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator, Set, Literal, Sequence
+from types import MappingProxyType
+from urllib.parse import urlsplit
+import aiofiles
 from playwright.async_api import async_playwright, Browser, Page, BrowserContext
 from agent.models import BrowserState
 
+logger = logging.getLogger(__name__)
+
+# Launch/context settings, dibangun sekali saat import
+_CHROMIUM_ARGS = (
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--no-first-run',
+    '--no-zygote',
+    '--disable-gpu'
+)
+_VIEWPORT = MappingProxyType({'width': 1280, 'height': 720})
+_BROWSER_TYPES = frozenset({"chromium", "firefox", "webkit"})
+_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Directory screenshot yang sudah dibuat
+_MKDIRS_DONE: Set[str] = set()
+
+# Resource types yang di-abort secara default (tidak dibutuhkan agent)
+DEFAULT_BLOCKED_RESOURCES = frozenset({"image", "media", "font"})
+
+# Analytics/ads hosts yang selalu di-abort (termasuk subdomain)
+_BLOCKED_HOSTS = frozenset({
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "mixpanel.com",
+    "scorecardresearch.com"
+})
+
+def _is_blocked_host(url: str) -> bool:
+    """Check apakah host (atau parent domain-nya) ada di blocklist"""
+    parts = (urlsplit(url).hostname or "").split(".")
+    return any(".".join(parts[i:]) in _BLOCKED_HOSTS for i in range(len(parts) - 1))
+
+# Single-pass scan untuk interactive elements
+INTERACTIVE_SCRIPT = """
+() => {
+    const elements = [];
+    const counters = {};
+    for (const el of document.querySelectorAll('button, input, textarea, a[href]')) {
+        const tagName = el.tagName.toLowerCase();
+        const nth = counters[tagName] = (counters[tagName] ?? -1) + 1;
+        
+        // Stable selector: id > data-testid > name > index per tag
+        let selector;
+        if (el.id) {
+            selector = `#${CSS.escape(el.id)}`;
+        } else if (el.dataset.testid) {
+            selector = `[data-testid="${CSS.escape(el.dataset.testid)}"]`;
+        } else if (el.name) {
+            selector = `${tagName}[name="${CSS.escape(el.name)}"]`;
+        } else {
+            // nth dihitung atas elemen yang cocok dengan query di atas, jadi base selector harus sama
+            selector = `${tagName === 'a' ? 'a[href]' : tagName} >> nth=${nth}`;
+        }
+        
+        const inputType = tagName === 'input' ? (el.type || 'text') : '';
+        if (tagName === 'button' || ['button', 'submit', 'reset'].includes(inputType)) {
+            const text = el.textContent.trim() || el.value || '';
+            if (text) {
+                elements.push({type: 'button', text, selector, tagName});
+            }
+        } else if (tagName === 'a') {
+            const text = el.textContent.trim();
+            if (text) {
+                elements.push({type: 'link', text, href: el.href, selector, tagName});
+            }
+        } else {
+            elements.push({
+                type: 'input',
+                inputType: inputType || 'text',
+                placeholder: el.placeholder || '',
+                name: el.name || '',
+                selector,
+                tagName
+            });
+        }
+        
+        if (elements.length >= 20) {  // Limit to first 20 elements
+            break;
+        }
+    }
+    
+    return elements;
+}
+"""
+
+# Dipasang sekali per context via add_init_script, jadi tersedia di setiap dokumen
+_INIT_SCRIPT = f"window.__getInteractive = {INTERACTIVE_SCRIPT.strip()};"
+_INTERACTIVE_CALL = "() => window.__getInteractive()"
+
+# Metadata page dalam satu evaluate
+_SNAPSHOT_SCRIPT = """
+() => ({
+    url: location.href,
+    title: document.title,
+    ready: document.readyState,
+    h1: document.querySelector('h1')?.innerText || ''
+})
+"""
+
+# Ringkasan page dalam satu evaluate, memakai scanner dari init script
+_SUMMARY_SCRIPT = """
+(maxChars) => {
+    // Text dari main content jika ada, selain itu body
+    const root = document.querySelector('main, [role="main"]') || document.body;
+    return {
+        title: document.title,
+        url: location.href,
+        headings: Array.from(document.querySelectorAll('h1, h2, h3'), h => h.innerText.trim()).filter(Boolean).slice(0, 20),
+        text: (root ? (root.innerText || root.textContent || '') : '').slice(0, maxChars),
+        interactive: window.__getInteractive()
+    };
+}
+"""
+
+# Playwright + browser di-share per proses; setiap BrowserManager hanya membuat context
+_shared: Dict[str, Any] = {"pw": None, "browsers": {}, "lock": asyncio.Lock()}
+
+# Batasi jumlah context yang hidup bersamaan supaya memory tetap terkendali
+MAX_BROWSER_CONTEXTS = int(os.getenv("MAX_BROWSER_CONTEXTS", "8"))
+_context_slots = asyncio.Semaphore(MAX_BROWSER_CONTEXTS)
+
+async def _start_playwright():
+    """Start shared Playwright jika belum berjalan (dipanggil di bawah lock)"""
+    if _shared["pw"] is None:
+        _shared["pw"] = await async_playwright().start()
+    return _shared["pw"]
+
+async def _get_browser(browser_type: str = "chromium", headless: bool = True, cdp_endpoint: Optional[str] = None,
+                       launch_args: Optional[Sequence[str]] = None) -> Browser:
+    """Get shared browser, launch (atau connect via CDP) sekali secara lazy
+    
+    launch_args menggantikan _CHROMIUM_ARGS; browser di-share per kombinasi args.
+    """
+    args = tuple(launch_args) if launch_args is not None else _CHROMIUM_ARGS
+    key = ("cdp", cdp_endpoint) if cdp_endpoint else (browser_type, headless, args)
+    browser = _shared["browsers"].get(key)
+    if browser is not None and browser.is_connected():
+        return browser
+    
+    async with _shared["lock"]:
+        browser = _shared["browsers"].get(key)
+        if browser is not None and browser.is_connected():
+            return browser
+        
+        playwright = await _start_playwright()
+        
+        # Connect ke Chromium eksternal yang sudah berjalan
+        if cdp_endpoint:
+            if browser_type != "chromium":
+                raise ValueError(f"CDP endpoint requires chromium, got: {browser_type}")
+            browser = await playwright.chromium.connect_over_cdp(cdp_endpoint)
+        # Launch browser
+        elif browser_type == "chromium":
+            browser = await playwright.chromium.launch(headless=headless, args=list(args), chromium_sandbox=False)
+        elif browser_type == "firefox":
+            browser = await playwright.firefox.launch(headless=headless)
+        elif browser_type == "webkit":
+            browser = await playwright.webkit.launch(headless=headless)
+        else:
+            raise ValueError(f"Unsupported browser type: {browser_type}")
+        
+        _shared["browsers"][key] = browser
+        return browser
+
+async def start_shared_browser(browser_type: str = "chromium", headless: bool = True, cdp_endpoint: Optional[str] = None,
+                               launch_args: Optional[Sequence[str]] = None) -> Browser:
+    """Pre-launch shared browser (misalnya saat server startup) supaya task pertama tidak menunggu launch"""
+    return await _get_browser(browser_type, headless, cdp_endpoint or os.getenv("CDP_ENDPOINT"), launch_args)
+
+async def shutdown_shared_browser():
+    """Close semua shared browser dan stop Playwright
+    
+    Untuk browser yang terhubung via CDP, close() hanya memutus koneksi;
+    proses Chromium eksternal tetap berjalan.
+    """
+    async with _shared["lock"]:
+        for browser in _shared["browsers"].values():
+            try:
+                await browser.close()
+            except Exception as e:
+                logger.warning("Error closing shared browser: %s", e)
+        _shared["browsers"].clear()
+        
+        if _shared["pw"] is not None:
+            await _shared["pw"].stop()
+            _shared["pw"] = None
+
+@asynccontextmanager
+async def acquire_context(browser_type: str = "chromium", headless: bool = True, **context_options) -> AsyncIterator[BrowserContext]:
+    """Acquire BrowserContext dari shared browser, otomatis di-close setelah selesai"""
+    async with _context_slots:
+        browser = await _get_browser(browser_type, headless)
+        context = await browser.new_context(**context_options)
+        try:
+            yield context
+        finally:
+            await context.close()
+
 class BrowserManager:
     """Manager untuk browser automation menggunakan Playwright"""
     
-    def __init__(self, headless: bool = True, browser_type: str = "chromium"):
+    def __init__(self, headless: bool = True, browser_type: str = "chromium",
+                 cdp_endpoint: Optional[str] = None, block_resources: Optional[Set[str]] = None,
+                 block_trackers: bool = True, user_data_dir: Optional[str] = None,
+                 launch_args: Optional[Sequence[str]] = None):
         self.headless = headless
         self.browser_type = browser_type
+        
+        # Chromium launch args (None = _CHROMIUM_ARGS), misalnya flag khusus CI
+        self.launch_args = launch_args
+        self.cdp_endpoint = cdp_endpoint or os.getenv("CDP_ENDPOINT")
+        
+        # Persistent profile (cookies, localStorage) yang bertahan antar run; HTTP cache
+        # hanya dipakai jika resource filter dimatikan (Playwright menonaktifkan cache saat routing aktif)
+        self.user_data_dir = user_data_dir
+        
+        # Resource filter; set() dan block_trackers=False untuk opt-out
+        self.block_resources: Set[str] = DEFAULT_BLOCKED_RESOURCES if block_resources is None else set(block_resources)
+        self.block_trackers = block_trackers
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.current_state = BrowserState()
+        self._holds_slot = False
+        
+        # Default screenshot path, dibuat saat screenshot pertama
+        self._default_screenshot_path: Optional[str] = None
     
     async def initialize(self) -> bool:
-        """Initialize browser"""
+        """Initialize browser context di atas shared browser"""
         try:
-            self.playwright = await async_playwright().start()
-            
-            # Launch browser
-            if self.browser_type == "chromium":
-                self.browser = await self.playwright.chromium.launch(
-                    headless=self.headless,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-accelerated-2d-canvas',
-                        '--no-first-run',
-                        '--no-zygote',
-                        '--disable-gpu'
-                    ]
-                )
-            elif self.browser_type == "firefox":
-                self.browser = await self.playwright.firefox.launch(headless=self.headless)
-            elif self.browser_type == "webkit":
-                self.browser = await self.playwright.webkit.launch(headless=self.headless)
+            await _context_slots.acquire()
+            self._holds_slot = True
+            
+            if self.user_data_dir:
+                # Persistent context punya browser process sendiri, tidak di-share
+                self.context = await self._launch_persistent_context()
+                self.browser = None
             else:
-                raise ValueError(f"Unsupported browser type: {self.browser_type}")
+                self.browser = await _get_browser(self.browser_type, self.headless, self.cdp_endpoint, self.launch_args)
+                
+                # Create context (juga untuk CDP, supaya tiap agent terisolasi)
+                self.context = await self.browser.new_context(viewport=dict(_VIEWPORT), user_agent=_USER_AGENT)
+            self.playwright = _shared["pw"]
+            initial_pages = list(self.context.pages)
+            
+            # Abort heavy/third-party resources
+            if self.block_resources or self.block_trackers:
+                await self.context.route("**/*", self._route_filter)
             
-            # Create context
-            self.context = await self.browser.new_context(
-                viewport={'width': 1280, 'height': 720},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            )
+            # Install interactive-elements scanner untuk semua dokumen di context
+            await self.context.add_init_script(_INIT_SCRIPT)
             
-            # Create page
+            # Create page (setelah init script terpasang), tutup tab bawaan persistent context
             self.page = await self.context.new_page()
+            for stale_page in initial_pages:
+                await stale_page.close()
             
             # Set default timeout
             self.page.set_default_timeout(30000)
             
             return True
         except Exception as e:
-            print(f"Failed to initialize browser: {e}")
+            logger.exception("Failed to initialize browser: %s", e)
+            self._release_slot()
             return False
     
+    async def reset_page(self) -> Page:
+        """Ganti page dengan page baru di context yang sama untuk task berikutnya
+        
+        Jauh lebih murah daripada membuat context/browser baru. Cookies ikut
+        di-clear kecuali untuk persistent profile.
+        """
+        if not self.context:
+            raise Exception("Browser context not initialized")
+        
+        old_page = self.page
+        if not self.user_data_dir:
+            await self.context.clear_cookies()
+        self.page = await self.context.new_page()
+        self.page.set_default_timeout(30000)
+        if old_page:
+            await old_page.close()
+        
+        self.current_state = BrowserState()
+        return self.page
+    
+    async def _launch_persistent_context(self) -> BrowserContext:
+        """Launch browser dengan persistent user-data-dir"""
+        async with _shared["lock"]:
+            playwright = await _start_playwright()
+        
+        if self.browser_type not in _BROWSER_TYPES:
+            raise ValueError(f"Unsupported browser type: {self.browser_type}")
+        
+        launch_args = list(self.launch_args if self.launch_args is not None else _CHROMIUM_ARGS) if self.browser_type == "chromium" else None
+        return await getattr(playwright, self.browser_type).launch_persistent_context(
+            user_data_dir=self.user_data_dir,
+            headless=self.headless,
+            args=launch_args,
+            viewport=dict(_VIEWPORT),
+            user_agent=_USER_AGENT
+        )
+    
+    async def _route_filter(self, route):
+        """Abort request untuk resource yang diblokir, lanjutkan sisanya"""
+        request = route.request
+        if request.resource_type in self.block_resources or (self.block_trackers and _is_blocked_host(request.url)):
+            await route.abort()
+        else:
+            await route.continue_()
+    
+    def _release_slot(self):
+        if self._holds_slot:
+            self._holds_slot = False
+            _context_slots.release()
+    
     async def close(self):
-        """Close browser dan cleanup"""
+        """Close context dan cleanup (shared browser tetap berjalan)
+        
+        Untuk persistent context, menutup context juga menutup browser process-nya.
+        """
         try:
             if self.page:
                 await self.page.close()
             if self.context:
                 await self.context.close()
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
         except Exception as e:
-            print(f"Error closing browser: {e}")
+            logger.warning("Error closing browser: %s", e)
+        finally:
+            self.page = None
+            self.context = None
+            self._release_slot()
     
-    async def navigate(self, url: str) -> Dict[str, Any]:
-        """Navigate ke URL"""
+    async def navigate(self, url: str, wait_selector: Optional[str] = None) -> Dict[str, Any]:
+        """Navigate ke URL
+        
+        Hanya menunggu domcontentloaded (networkidle sering tidak tercapai di page
+        dengan banyak tracker). Berikan wait_selector untuk menunggu element yang
+        benar-benar dibutuhkan oleh step berikutnya.
+        """
         try:
             if not self.page:
                 raise Exception("Browser not initialized")
             
             await self.page.goto(url, wait_until="domcontentloaded")
-            await self.page.wait_for_load_state("networkidle", timeout=10000)
             
-            # Update state
-            self.current_state.current_url = self.page.url
-            self.current_state.page_title = await self.page.title()
+            if wait_selector:
+                await self.page.locator(wait_selector).first.wait_for(state="visible", timeout=10000)
+            
+            # Update state (satu round-trip untuk url + title)
+            snapshot = await self._snapshot()
+            self.current_state.current_url = snapshot["url"]
+            self.current_state.page_title = snapshot["title"]
             
             return {
                 "success": True,
@@ -100,20 +389,26 @@ class BrowserManager:
                 "error": str(e)
             }
     
-    async def click_element(self, selector: str) -> Dict[str, Any]:
-        """Click element berdasarkan selector"""
+    async def _snapshot(self) -> Dict[str, Any]:
+        """Baca url, title, readyState, dan h1 dalam satu evaluate"""
+        return await self.page.evaluate(_SNAPSHOT_SCRIPT)
+    
+    async def click_element(self, selector: str, expect_navigation: bool = False) -> Dict[str, Any]:
+        """Click element berdasarkan selector
+        
+        Set expect_navigation=True jika click diketahui memicu navigasi.
+        """
         try:
             if not self.page:
                 raise Exception("Browser not initialized")
             
-            # Wait for element
-            await self.page.wait_for_selector(selector, timeout=10000)
-            
-            # Click element
-            await self.page.click(selector)
-            
-            # Wait for potential page changes
-            await asyncio.sleep(1)
+            # Locator auto-waits, jadi tidak perlu wait_for_selector terpisah; .first seperti
+            # page.click, karena selector dari scanner tidak selalu unik (radio group, testid ganda)
+            if expect_navigation:
+                async with self.page.expect_navigation(wait_until="domcontentloaded"):
+                    await self.page.locator(selector).first.click(timeout=10000)
+            else:
+                await self.page.locator(selector).first.click(timeout=10000)
             
             # Update current URL in case of navigation
             self.current_state.current_url = self.page.url
@@ -135,11 +430,8 @@ class BrowserManager:
             if not self.page:
                 raise Exception("Browser not initialized")
             
-            # Wait for element
-            await self.page.wait_for_selector(selector, timeout=10000)
-            
-            # Clear and type
-            await self.page.fill(selector, text)
+            # Clear and type (locator auto-waits, first match seperti page.fill)
+            await self.page.locator(selector).first.fill(text, timeout=10000)
             
             return {
                 "success": True,
@@ -153,13 +445,12 @@ class BrowserManager:
             }
     
     async def get_page_content(self) -> Dict[str, Any]:
-        """Get current page content"""
+        """Get raw HTML dari current page (untuk debugging; LLM memakai get_page_summary)"""
         try:
             if not self.page:
                 raise Exception("Browser not initialized")
             
-            content = await self.page.content()
-            title = await self.page.title()
+            content, title = await asyncio.gather(self.page.content(), self.page.title())
             url = self.page.url
             
             return {
@@ -174,25 +465,53 @@ class BrowserManager:
                 "error": str(e)
             }
     
-    async def take_screenshot(self, path: Optional[str] = None) -> Dict[str, Any]:
-        """Take screenshot dari current page"""
+    async def take_screenshot(self, path: Optional[str] = None, fmt: Optional[Literal["png", "jpeg"]] = None,
+                              quality: int = 60, full_page: bool = False, return_bytes: bool = False) -> Dict[str, Any]:
+        """Take screenshot dari current page
+        
+        Default JPEG viewport screenshot; format mengikuti ekstensi path jika fmt tidak diberikan.
+        Dengan return_bytes=True screenshot tidak ditulis ke disk; selain itu result berisi
+        screenshot_path dan bytes dari encode yang sama.
+        """
         try:
             if not self.page:
                 raise Exception("Browser not initialized")
             
+            if fmt is None:
+                fmt = "png" if path and path.lower().endswith(".png") else "jpeg"
+            quality_arg = quality if fmt == "jpeg" else None
+            
+            # Encode sekali; buffer yang sama dipakai untuk disk dan consumer in-memory
+            buffer = await self.page.screenshot(type=fmt, quality=quality_arg, full_page=full_page)
+            
+            if return_bytes:
+                return {
+                    "success": True,
+                    "bytes": buffer
+                }
+            
             if not path:
-                path = f"/app/screenshots/screenshot_{int(asyncio.get_event_loop().time())}.png"
+                # Default path dibuat sekali per manager dan di-overwrite setiap screenshot
+                extension = "png" if fmt == "png" else "jpg"
+                if not self._default_screenshot_path or not self._default_screenshot_path.endswith(extension):
+                    self._default_screenshot_path = f"/app/screenshots/screenshot_{time.time_ns() // 1_000_000}.{extension}"
+                path = self._default_screenshot_path
             
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Ensure directory exists (sekali per directory)
+            directory = os.path.dirname(path)
+            if directory not in _MKDIRS_DONE:
+                os.makedirs(directory, exist_ok=True)
+                _MKDIRS_DONE.add(directory)
             
-            await self.page.screenshot(path=path, full_page=True)
+            async with aiofiles.open(path, "wb") as f:
+                await f.write(buffer)
             
             self.current_state.screenshot_path = path
             
             return {
                 "success": True,
-                "screenshot_path": path
+                "screenshot_path": path,
+                "bytes": buffer
             }
         except Exception as e:
             return {
@@ -246,63 +565,32 @@ class BrowserManager:
             if not self.page:
                 raise Exception("Browser not initialized")
             
-            # JavaScript untuk get interactive elements
-            script = """
-            () => {
-                const elements = [];
-                
-                // Get buttons
-                document.querySelectorAll('button, input[type="button"], input[type="submit"]').forEach((el, index) => {
-                    const text = el.textContent.trim() || el.value || '';
-                    if (text) {
-                        elements.push({
-                            type: 'button',
-                            text: text,
-                            selector: `button:nth-of-type(${index + 1})`,
-                            tagName: el.tagName.toLowerCase()
-                        });
-                    }
-                });
-                
-                // Get links
-                document.querySelectorAll('a[href]').forEach((el, index) => {
-                    const text = el.textContent.trim();
-                    if (text) {
-                        elements.push({
-                            type: 'link',
-                            text: text,
-                            href: el.href,
-                            selector: `a:nth-of-type(${index + 1})`,
-                            tagName: el.tagName.toLowerCase()
-                        });
-                    }
-                });
-                
-                // Get input fields
-                document.querySelectorAll('input, textarea').forEach((el, index) => {
-                    elements.push({
-                        type: 'input',
-                        inputType: el.type || 'text',
-                        placeholder: el.placeholder || '',
-                        name: el.name || '',
-                        selector: `${el.tagName.toLowerCase()}:nth-of-type(${index + 1})`,
-                        tagName: el.tagName.toLowerCase()
-                    });
-                });
-                
-                return elements.slice(0, 20); // Limit to first 20 elements
+            elements = await self.page.evaluate(_INTERACTIVE_CALL)
+            
+            return {
+                "success": True,
+                "elements": elements
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
             }
-            """
+    
+    async def get_page_summary(self, max_chars: int = 8000) -> Dict[str, Any]:
+        """Get ringkasan struktural page untuk LLM (title, headings, text, interactive elements)"""
+        try:
+            if not self.page:
+                raise Exception("Browser not initialized")
             
-            elements = await self.page.evaluate(script)
+            summary = await self.page.evaluate(_SUMMARY_SCRIPT, max_chars)
             
             return {
                 "success": True,
-                "elements": elements
+                **summary
             }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
-
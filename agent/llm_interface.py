@@ -2,9 +2,16 @@
 LLM Interface untuk Autonomous Agent
 """
 import os
-import json
-from typing import Dict, Any, List, Optional
+import re
+import asyncio
+import logging
+import hashlib
+from collections import OrderedDict
+from string import Template
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
 from abc import ABC, abstractmethod
+import httpx
+import orjson
 
 try:
     import openai
@@ -18,191 +25,316 @@ try:
 except ImportError:
     ANTHROPIC_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
+# Batas jumlah LLM request yang berjalan bersamaan di proses ini
+_LLM_SEM = asyncio.Semaphore(int(os.getenv("LLM_MAX_INFLIGHT", "8")))
+
+# Satu client (dan connection pool) per (provider, api_key), di-share antar agent
+_CLIENTS: Dict[Tuple[str, Optional[str]], Any] = {}
+
+def _shared_client(provider: str, api_key: Optional[str]):
+    """Get atau buat shared API client untuk provider dan api_key"""
+    key = (provider, api_key)
+    client = _CLIENTS.get(key)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+        if provider == "openai":
+            client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client)
+        else:
+            client = anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client)
+        _CLIENTS[key] = client
+    return client
+
+# Batas panjang current state di prompt (membatasi prompt tokens)
+_MAX_STATE_CHARS = 4000
+
+# JSON di dalam markdown code block (closing fence bisa hilang jika stream dihentikan lebih awal)
+_JSON_BLOCK = re.compile(r'```json\n(.*?)(?:```|\Z)', re.DOTALL)
+
+# Bagian statis dari planning prompt (role, tools, JSON schema). Dikirim verbatim
+# sebagai system prompt supaya backend dapat memakai prefix cache.
+_SYSTEM_TMPL = Template("""Anda adalah autonomous agent yang dapat melakukan browser automation.
+
+AVAILABLE TOOLS:
+$tools
+
+Berdasarkan goal dan current state, tentukan action selanjutnya.
+Respond dalam format JSON:
+{
+    "reasoning": "Penjelasan mengapa memilih action ini",
+    "tool_name": "nama_tool",
+    "parameters": {"param1": "value1"},
+    "expected_outcome": "Apa yang diharapkan terjadi",
+    "goal_achieved": "YES jika goal sudah tercapai pada current state, selain itu NO"
+}""")
+
+def build_planning_system_prompt(tools: Dict[str, str]) -> str:
+    """Build static system prompt dari tool manifest (signature -> deskripsi)"""
+    lines = [f"{i}. {signature} - {description}" for i, (signature, description) in enumerate(tools.items(), 1)]
+    return _SYSTEM_TMPL.substitute(tools="\n".join(lines))
+
+PLANNING_SYSTEM_PROMPT = build_planning_system_prompt({
+    "navigate(url)": "Navigate to a URL",
+    "click(selector)": "Click element by CSS selector or XPath",
+    "type(selector, text)": "Type text into input field",
+    "read_dom()": "Read current page DOM",
+    "wait(seconds)": "Wait for specified seconds"
+})
+
+# Bagian dinamis dari planning prompt
+_PROMPT_TMPL = Template("""
+GOAL: $goal
+
+CURRENT STATE:
+$current_state
+
+HISTORY:
+$history
+""")
+
+def _build_prompt(goal: str, current_state: str, history: List[str]) -> str:
+    """Build planning prompt dari goal, state, dan 5 history terakhir"""
+    history_text = "\n".join(history[-5:]) if history else "No previous actions"
+    return _PROMPT_TMPL.substitute(goal=goal, current_state=current_state[:_MAX_STATE_CHARS], history=history_text)
+
+def _parse_action(response: str) -> Dict[str, Any]:
+    """Parse action plan JSON dari LLM response"""
+    try:
+        # Try to parse JSON response directly
+        return orjson.loads(response)
+    except orjson.JSONDecodeError:
+        pass
+    
+    # If direct parsing fails, try to extract JSON from markdown code block
+    try:
+        json_match = _JSON_BLOCK.search(response)
+        if not json_match:
+            raise ValueError("No JSON found in LLM response")
+        return orjson.loads(json_match.group(1))
+    except ValueError as e:
+        # Fallback jika response bukan JSON valid atau tidak ada JSON di markdown
+        logger.warning("Failed to parse LLM response: %s. Raw response: %.200s...", e, response)
+        return {
+            "reasoning": "Failed to parse LLM response",
+            "tool_name": "wait",
+            "parameters": {"seconds": 1},
+            "expected_outcome": "Wait and retry"
+        }
+
+async def _collect_stream(chunks: AsyncIterator[str]) -> str:
+    """Kumpulkan streamed text, berhenti begitu JSON object pertama tertutup"""
+    parts: List[str] = []
+    opened = closed = 0
+    async for text in chunks:
+        parts.append(text)
+        opened += text.count("{")
+        closed += text.count("}")
+        if opened and opened == closed:
+            break
+    return "".join(parts)
+
 class LLMInterface(ABC):
     """Abstract base class untuk LLM interface"""
     
+    # Jumlah response yang di-cache per interface
+    cache_size = 256
+    # Default sampling temperature; response hanya di-cache kalau deterministik (temperature 0)
+    temperature = 0.7
+    
+    def __init__(self, temperature: Optional[float] = None):
+        if temperature is None and os.getenv("LLM_TEMPERATURE"):
+            temperature = float(os.getenv("LLM_TEMPERATURE"))
+        if temperature is not None:
+            self.temperature = temperature
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+    
+    def _cache_key(self, *parts: str) -> str:
+        return hashlib.blake2b("\0".join(parts).encode(), digest_size=16).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        if self.temperature:
+            return None
+        response = self._cache.get(key)
+        if response is not None:
+            self._cache.move_to_end(key)
+        return response
+    
+    def _cache_put(self, key: str, response: str):
+        if self.temperature:
+            return
+        self._cache[key] = response
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+    
     @abstractmethod
-    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
-        """Generate response dari LLM"""
+    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None, stream: bool = False,
+                                system: Optional[str] = None) -> str:
+        """Generate response dari LLM
+        
+        Dengan stream=True, generation dihentikan begitu JSON object pertama lengkap.
+        """
         pass
     
-    @abstractmethod
-    async def plan_next_action(self, goal: str, current_state: str, history: List[str]) -> Dict[str, Any]:
+    async def plan_next_action(self, goal: str, current_state: str, history: List[str],
+                               system: Optional[str] = None) -> Dict[str, Any]:
         """Plan next action berdasarkan goal dan current state"""
-        pass
+        response = await self.generate_response(
+            _build_prompt(goal, current_state, history),
+            stream=True,
+            system=system or PLANNING_SYSTEM_PROMPT
+        )
+        return _parse_action(response)
 
 class OpenAIInterface(LLMInterface):
     """Interface untuk OpenAI GPT models"""
     
-    def __init__(self, model: str = "gemini-2.5-flash", api_key: Optional[str] = None):
+    def __init__(self, model: str = "gemini-2.5-flash", api_key: Optional[str] = None,
+                 temperature: Optional[float] = None):
         if not OPENAI_AVAILABLE:
             raise ImportError("OpenAI package not available")
         
+        super().__init__(temperature)
         self.model = model
-        self.client = openai.AsyncOpenAI(
-            api_key=api_key or os.getenv("OPENAI_API_KEY")
-        )
+        self.client = _shared_client("openai", api_key or os.getenv("OPENAI_API_KEY"))
     
-    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None, stream: bool = False,
+                                system: Optional[str] = None) -> str:
         """Generate response dari OpenAI"""
         try:
             messages = [{"role": "user", "content": prompt}]
             
+            system_message = ""
             if context:
-                system_message = f"Context: {json.dumps(context, indent=2)}"
+                system_message = f"Context: {orjson.dumps(context, option=orjson.OPT_INDENT_2).decode()}"
                 messages.insert(0, {"role": "system", "content": system_message})
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
+            # Static system prompt selalu paling depan (shared prefix)
+            if system:
+                messages.insert(0, {"role": "system", "content": system})
+            
+            key = self._cache_key(self.model, system or "", system_message, prompt)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
             
-            return response.choices[0].message.content
+            async with _LLM_SEM:
+                if stream:
+                    chunks = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        max_tokens=1000,
+                        stream=True
+                    )
+                    try:
+                        content = await _collect_stream(
+                            chunk.choices[0].delta.content or ""
+                            async for chunk in chunks if chunk.choices
+                        )
+                    finally:
+                        await chunks.response.aclose()
+                else:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        max_tokens=1000
+                    )
+                    content = response.choices[0].message.content
+            
+            self._cache_put(key, content)
+            return content
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}")
-    
-    async def plan_next_action(self, goal: str, current_state: str, history: List[str]) -> Dict[str, Any]:
-        """Plan next action menggunakan OpenAI"""
-        prompt = f"""
-Anda adalah autonomous agent yang dapat melakukan browser automation.
-
-GOAL: {goal}
-
-CURRENT STATE:
-{current_state}
-
-HISTORY:
-{chr(10).join(history[-5:]) if history else "No previous actions"}
-
-AVAILABLE TOOLS:
-1. navigate(url) - Navigate to a URL
-2. click(selector) - Click element by CSS selector or XPath
-3. type(selector, text) - Type text into input field
-4. read_dom() - Read current page DOM
-5. wait(seconds) - Wait for specified seconds
-
-Berdasarkan goal dan current state, tentukan action selanjutnya.
-Respond dalam format JSON:
-{{
-    "reasoning": "Penjelasan mengapa memilih action ini",
-    "tool_name": "nama_tool",
-    "parameters": {{"param1": "value1"}},
-    "expected_outcome": "Apa yang diharapkan terjadi"
-}}
-"""
-        
-        response = await self.generate_response(prompt)
-        
-        try:
-            # Try to parse JSON response directly
-            action_plan = json.loads(response)
-            return action_plan
-        except json.JSONDecodeError:
-            # If direct parsing fails, try to extract JSON from markdown code block
-            try:
-                import re
-                json_match = re.search(r'```json\n(.*?)```', response, re.DOTALL)
-                if json_match:
-                    action_plan = json.loads(json_match.group(1))
-                    return action_plan
-                else:
-                    raise ValueError("No JSON found in LLM response")
-            except (json.JSONDecodeError, ValueError) as e:
-                # Fallback jika response bukan JSON valid atau tidak ada JSON di markdown
-                print(f"Failed to parse LLM response: {e}. Raw response: {response[:200]}...")
-                return {
-                    "reasoning": "Failed to parse LLM response",
-                    "tool_name": "wait",
-                    "parameters": {"seconds": 1},
-                    "expected_outcome": "Wait and retry"
-                }
 
 class AnthropicInterface(LLMInterface):
     """Interface untuk Anthropic Claude models"""
     
-    def __init__(self, model: str = "claude-3-sonnet-20240229", api_key: Optional[str] = None):
+    temperature = 1.0
+    
+    def __init__(self, model: str = "claude-3-sonnet-20240229", api_key: Optional[str] = None,
+                 temperature: Optional[float] = None):
         if not ANTHROPIC_AVAILABLE:
             raise ImportError("Anthropic package not available")
         
+        super().__init__(temperature)
         self.model = model
-        self.client = anthropic.AsyncAnthropic(
-            api_key=api_key or os.getenv("ANTHROPIC_API_KEY")
-        )
+        self.client = _shared_client("anthropic", api_key or os.getenv("ANTHROPIC_API_KEY"))
     
-    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None, stream: bool = False,
+                                system: Optional[str] = None) -> str:
         """Generate response dari Anthropic Claude"""
         try:
             full_prompt = prompt
             if context:
-                full_prompt = f"Context: {json.dumps(context, indent=2)}\n\n{prompt}"
+                full_prompt = f"Context: {orjson.dumps(context, option=orjson.OPT_INDENT_2).decode()}\n\n{prompt}"
             
-            response = await self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
-                messages=[{"role": "user", "content": full_prompt}]
-            )
+            # Anthropic menerima system prompt sebagai parameter terpisah
+            system_kwargs = {"system": system} if system else {}
             
-            return response.content[0].text
+            key = self._cache_key(self.model, system or "", full_prompt)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+            
+            async with _LLM_SEM:
+                if stream:
+                    async with self.client.messages.stream(
+                        model=self.model,
+                        max_tokens=1000,
+                        temperature=self.temperature,
+                        messages=[{"role": "user", "content": full_prompt}],
+                        **system_kwargs
+                    ) as response_stream:
+                        content = await _collect_stream(response_stream.text_stream)
+                else:
+                    response = await self.client.messages.create(
+                        model=self.model,
+                        max_tokens=1000,
+                        temperature=self.temperature,
+                        messages=[{"role": "user", "content": full_prompt}],
+                        **system_kwargs
+                    )
+                    content = response.content[0].text
+            
+            self._cache_put(key, content)
+            return content
         except Exception as e:
             raise Exception(f"Anthropic API error: {str(e)}")
-    
-    async def plan_next_action(self, goal: str, current_state: str, history: List[str]) -> Dict[str, Any]:
-        """Plan next action menggunakan Claude"""
-        prompt = f"""
-Anda adalah autonomous agent yang dapat melakukan browser automation.
-
-GOAL: {goal}
-
-CURRENT STATE:
-{current_state}
 
-HISTORY:
-{chr(10).join(history[-5:]) if history else "No previous actions"}
-
-AVAILABLE TOOLS:
-1. navigate(url) - Navigate to a URL
-2. click(selector) - Click element by CSS selector or XPath  
-3. type(selector, text) - Type text into input field
-4. read_dom() - Read current page DOM
-5. wait(seconds) - Wait for specified seconds
-
-Berdasarkan goal dan current state, tentukan action selanjutnya.
-Respond dalam format JSON:
-{{
-    "reasoning": "Penjelasan mengapa memilih action ini",
-    "tool_name": "nama_tool", 
-    "parameters": {{"param1": "value1"}},
-    "expected_outcome": "Apa yang diharapkan terjadi"
-}}
-"""
-        
-        response = await self.generate_response(prompt)
-        
-        try:
-            # Try to parse JSON response directly
-            action_plan = json.loads(response)
-            return action_plan
-        except json.JSONDecodeError:
-            # If direct parsing fails, try to extract JSON from markdown code block
-            try:
-                import re
-                json_match = re.search(r'```json\n(.*?)```', response, re.DOTALL)
-                if json_match:
-                    action_plan = json.loads(json_match.group(1))
-                    return action_plan
-                else:
-                    raise ValueError("No JSON found in LLM response")
-            except (json.JSONDecodeError, ValueError) as e:
-                # Fallback jika response bukan JSON valid atau tidak ada JSON di markdown
-                print(f"Failed to parse LLM response: {e}. Raw response: {response[:200]}...")
-                return {
-                    "reasoning": "Failed to parse LLM response",
-                    "tool_name": "wait",
-                    "parameters": {"seconds": 1},
-                    "expected_outcome": "Wait and retry"
-                }
+class MockLLMInterface(LLMInterface):
+    """Deterministic LLM tanpa network untuk testing
+    
+    Action pertama navigate ke start_url, lalu read_dom dengan goal_achieved YES.
+    """
+    
+    def __init__(self, start_url: str = "https://example.com"):
+        super().__init__()
+        self.start_url = start_url
+    
+    async def generate_response(self, prompt: str, context: Optional[Dict[str, Any]] = None, stream: bool = False,
+                                system: Optional[str] = None) -> str:
+        """Generate plan berdasarkan ada/tidaknya history di prompt"""
+        if "No previous actions" in prompt:
+            action = {
+                "reasoning": f"Navigate ke {self.start_url}",
+                "tool_name": "navigate",
+                "parameters": {"url": self.start_url},
+                "expected_outcome": "Page terbuka",
+                "goal_achieved": "NO"
+            }
+        else:
+            action = {
+                "reasoning": "Page sudah terbuka, baca content lalu selesai",
+                "tool_name": "read_dom",
+                "parameters": {},
+                "expected_outcome": "Content terbaca",
+                "goal_achieved": "YES"
+            }
+        return orjson.dumps(action).decode()
 
 def create_llm_interface(provider: str = "openai", **kwargs) -> LLMInterface:
     """Factory function untuk membuat LLM interface"""
@@ -210,6 +342,8 @@ def create_llm_interface(provider: str = "openai", **kwargs) -> LLMInterface:
         return OpenAIInterface(**kwargs)
     elif provider.lower() == "anthropic":
         return AnthropicInterface(**kwargs)
+    elif provider.lower() == "mock":
+        return MockLLMInterface(**kwargs)
     else:
         raise ValueError(f"Unsupported LLM provider: {provider}")
 
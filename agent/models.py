@@ -1,9 +1,10 @@
 """
 Data models untuk Autonomous Agent
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Dict, Any, List, Optional
 from enum import Enum
+from dataclasses import dataclass
 
 class TaskType(str, Enum):
     """Jenis task yang dapat dijalankan agent"""
@@ -15,6 +16,8 @@ class TaskType(str, Enum):
 
 class AgentRequest(BaseModel):
     """Request model untuk agent task"""
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     goal: str
     task_type: Optional[TaskType] = TaskType.CUSTOM
     parameters: Optional[Dict[str, Any]] = {}
@@ -23,6 +26,8 @@ class AgentRequest(BaseModel):
 
 class ToolCall(BaseModel):
     """Model untuk tool call"""
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     tool_name: str
     parameters: Dict[str, Any]
     result: Optional[Any] = None
@@ -30,6 +35,8 @@ class ToolCall(BaseModel):
 
 class AgentStep(BaseModel):
     """Model untuk satu langkah agent"""
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     step_number: int
     planning: str
     tool_call: ToolCall
@@ -38,6 +45,8 @@ class AgentStep(BaseModel):
 
 class AgentResponse(BaseModel):
     """Response model untuk agent task"""
+    model_config = ConfigDict(extra="ignore", validate_assignment=False)
+    
     task_id: str
     goal: str
     status: str  # "running", "completed", "failed", "stopped"
@@ -46,8 +55,9 @@ class AgentResponse(BaseModel):
     error: Optional[str] = None
     execution_time: Optional[float] = None
 
-class BrowserState(BaseModel):
-    """Model untuk state browser"""
+@dataclass(slots=True)
+class BrowserState:
+    """State browser (internal, tidak dikirim lewat API)"""
     current_url: Optional[str] = None
     page_title: Optional[str] = None
     dom_summary: Optional[str] = None
@@ -2,21 +2,45 @@
 Agent Orchestrator - Main loop untuk perencanaan-eksekusi-observasi
 """
 import asyncio
+import logging
 import time
 import uuid
-from typing import Dict, Any, List, Optional
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator, Union
 from agent.models import AgentRequest, AgentResponse, AgentStep, ToolCall, BrowserState
-from agent.llm_interface import create_llm_interface, LLMInterface
+from agent.llm_interface import create_llm_interface, LLMInterface, build_planning_system_prompt
 from agent.browser_manager import BrowserManager
 from agent.toolset import Toolset
 
+logger = logging.getLogger(__name__)
+
+# Batas jumlah verdict goal check yang disimpan
+GOAL_CACHE_SIZE = 1024
+
+# Jumlah planning terakhir yang dikirim sebagai history ke LLM
+HISTORY_WINDOW = 5
+
+def _parse_verdict(value: Any) -> Optional[bool]:
+    """Parse field YES/NO (atau boolean) dari LLM; None jika tidak ada/tidak dikenali"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        verdict = value.strip().upper()
+        if verdict.startswith("YES"):
+            return True
+        if verdict.startswith("NO"):
+            return False
+    return None
+
 class AgentOrchestrator:
     """Main orchestrator untuk autonomous agent"""
     
-    def __init__(self, llm_provider: str = "openai", browser_type: str = "chromium", headless: bool = True):
+    def __init__(self, llm_provider: str = "openai", browser_type: str = "chromium", headless: bool = True,
+                 launch_args: Optional[List[str]] = None):
         self.llm_provider = llm_provider
         self.browser_type = browser_type
         self.headless = headless
+        self.launch_args = launch_args
         
         # Components
         self.llm: Optional[LLMInterface] = None
@@ -28,6 +52,15 @@ class AgentOrchestrator:
         self.current_response: Optional[AgentResponse] = None
         self.is_running = False
         
+        # Sliding window planning history untuk task yang sedang berjalan
+        self._planning_history: "deque[str]" = deque(maxlen=HISTORY_WINDOW)
+        
+        # Static system prompt, dibangun saat initialize
+        self._system_prompt: Optional[str] = None
+        
+        # Cache verdict goal check per (goal, observation hash)
+        self._goal_cache: Dict[Tuple[str, int], bool] = {}
+        
     async def initialize(self):
         """Initialize semua components"""
         try:
@@ -37,7 +70,8 @@ class AgentOrchestrator:
             # Initialize browser
             self.browser_manager = BrowserManager(
                 headless=self.headless,
-                browser_type=self.browser_type
+                browser_type=self.browser_type,
+                launch_args=self.launch_args
             )
             await self.browser_manager.initialize()
             
@@ -47,16 +81,26 @@ class AgentOrchestrator:
                 page=self.browser_manager.page
             )
             
-            print("Agent orchestrator initialized successfully")
+            # Static prefix dari tool manifest, dibangun sekali dan dipakai semua LLM call
+            self._system_prompt = build_planning_system_prompt(self.toolset.get_tool_manifest())
+            
+            logger.info("Agent orchestrator initialized successfully")
             return True
         except Exception as e:
-            print(f"Failed to initialize agent orchestrator: {e}")
+            logger.exception("Failed to initialize agent orchestrator: %s", e)
             return False
     
     async def execute_task(self, request: AgentRequest) -> AgentResponse:
         """Execute agent task dengan planning-execution-observation loop"""
+        response = None
+        async for event in self.stream_task(request):
+            response = event
+        return response
+    
+    async def stream_task(self, request: AgentRequest) -> AsyncIterator[Union[AgentStep, AgentResponse]]:
+        """Jalankan agent task, yield setiap AgentStep begitu selesai dan AgentResponse di akhir"""
         task_id = str(uuid.uuid4())
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # Initialize response
         response = AgentResponse(
@@ -69,27 +113,37 @@ class AgentOrchestrator:
         self.current_task = request
         self.current_response = response
         self.is_running = True
+        self._planning_history.clear()
         
         try:
+            # Page baru di context yang sama; browser dan context tetap dipakai ulang
+            if self.browser_manager and self.toolset:
+                page = await self.browser_manager.reset_page()
+                self.toolset.update_browser_context(self.browser_manager.browser, page)
+            
+            # Observation terakhir yang benar-benar melewati goal check
+            last_checked_observation: Optional[str] = None
+            
             # Main agent loop
             for step_number in range(1, request.max_iterations + 1):
                 if not self.is_running:
                     response.status = "stopped"
                     break
                 
-                print(f"\\n=== Step {step_number} ===")
+                logger.info("=== Step %d ===", step_number)
                 
                 # 1. OBSERVATION - Get current state
                 observation = await self._get_current_observation()
-                print(f"Observation: {observation[:200]}...")
+                logger.debug("Observation: %.200s...", observation)
                 
                 # 2. PLANNING - LLM decides next action
                 planning_result = await self._plan_next_action(
                     goal=request.goal,
                     current_state=observation,
-                    history=[step.planning for step in response.steps]
+                    history=list(self._planning_history)
                 )
-                print(f"Planning: {planning_result.get('reasoning', 'No reasoning provided')}")
+                self._planning_history.append(planning_result.get('reasoning', ''))
+                logger.info("Planning: %s", planning_result.get('reasoning', 'No reasoning provided'))
                 
                 # 3. EXECUTION - Execute planned action
                 tool_call = ToolCall(
@@ -101,7 +155,7 @@ class AgentOrchestrator:
                 tool_call.result = execution_result.get('result')
                 tool_call.error = execution_result.get('error')
                 
-                print(f"Execution: {tool_call.tool_name} -> {'Success' if execution_result.get('success') else 'Failed'}")
+                logger.info("Execution: %s -> %s", tool_call.tool_name, 'Success' if execution_result.get('success') else 'Failed')
                 
                 # 4. Create step record
                 step = AgentStep(
@@ -113,23 +167,34 @@ class AgentOrchestrator:
                 )
                 
                 response.steps.append(step)
+                yield step
                 
                 # 5. Check if goal achieved atau error
-                if await self._is_goal_achieved(request.goal, observation):
+                # Planner sudah menjawab goal_achieved; goal check terpisah hanya sebagai fallback
+                goal_achieved = _parse_verdict(planning_result.get('goal_achieved'))
+                if goal_achieved is None:
+                    # Tool gagal atau observation sama dengan yang terakhir dicek -> skip LLM call
+                    if step.success and observation != last_checked_observation:
+                        goal_achieved = await self._is_goal_achieved(request.goal, observation)
+                        last_checked_observation = observation
+                    else:
+                        goal_achieved = False
+                
+                if goal_achieved:
                     response.status = "completed"
                     response.final_result = "Goal achieved successfully"
                     break
                 
                 if not step.success:
                     # Try to recover atau continue
-                    print(f"Step failed: {tool_call.error}")
+                    logger.warning("Step failed: %s", tool_call.error)
                     if step_number >= 3:  # Stop after 3 consecutive failures
                         response.status = "failed"
                         response.error = f"Multiple failures: {tool_call.error}"
                         break
                 
-                # Small delay between steps
-                await asyncio.sleep(1)
+                # Yield ke event loop antar step tanpa idle delay
+                await asyncio.sleep(0)
             
             # If loop completed without achieving goal
             if response.status == "running":
@@ -139,15 +204,15 @@ class AgentOrchestrator:
         except Exception as e:
             response.status = "failed"
             response.error = str(e)
-            print(f"Task execution failed: {e}")
+            logger.exception("Task execution failed: %s", e)
         
         finally:
-            response.execution_time = time.time() - start_time
+            response.execution_time = time.perf_counter() - start_time
             self.is_running = False
             self.current_task = None
             self.current_response = None
         
-        return response
+        yield response
     
     async def _get_current_observation(self) -> str:
         """Get current state observation"""
@@ -155,24 +220,25 @@ class AgentOrchestrator:
             if not self.browser_manager or not self.browser_manager.page:
                 return "Browser not initialized"
             
-            # Get page content summary
-            dom_result = await self.toolset.execute_tool("read_dom")
+            # Get structural page summary
+            summary = await self.browser_manager.get_page_summary(max_chars=2000)
             
-            if dom_result.get('success'):
-                result = dom_result['result']
-                observation = f"""
-Current URL: {result.get('url', 'Unknown')}
-Page Title: {result.get('title', 'Unknown')}
-Page Content Preview: {result.get('text_preview', 'No content')}
-
-Interactive Elements:
-"""
-                for element in result.get('interactive_elements', [])[:5]:  # Limit to 5 elements
-                    observation += f"- {element.get('type', 'unknown')}: {element.get('text', element.get('placeholder', 'N/A'))}\\n"
+            if summary.get('success'):
+                lines = [
+                    f"Current URL: {summary.get('url', 'Unknown')}",
+                    f"Page Title: {summary.get('title', 'Unknown')}",
+                    f"Headings: {' | '.join(summary.get('headings', [])) or 'None'}",
+                    f"Page Content Preview: {summary.get('text') or 'No content'}",
+                    "",
+                    "Interactive Elements:"
+                ]
+                for element in summary.get('interactive', [])[:10]:  # Limit to 10 elements
+                    label = element.get('text') or element.get('placeholder') or element.get('name') or 'N/A'
+                    lines.append(f"- {element.get('type', 'unknown')}: {label} ({element.get('selector')})")
                 
-                return observation.strip()
+                return "\n".join(lines)
             else:
-                return f"Failed to read DOM: {dom_result.get('error', 'Unknown error')}"
+                return f"Failed to read page: {summary.get('error', 'Unknown error')}"
         
         except Exception as e:
             return f"Error getting observation: {str(e)}"
@@ -183,10 +249,10 @@ Interactive Elements:
             if not self.llm:
                 raise Exception("LLM not initialized")
             
-            return await self.llm.plan_next_action(goal, current_state, history)
+            return await self.llm.plan_next_action(goal, current_state, history, system=self._system_prompt)
         
         except Exception as e:
-            print(f"Planning failed: {e}")
+            logger.warning("Planning failed: %s", e)
             # Fallback action
             return {
                 "reasoning": f"Planning failed: {str(e)}. Waiting.",
@@ -218,6 +284,11 @@ Interactive Elements:
             if not self.llm:
                 return False
             
+            # Observation yang sama (misalnya setelah tool gagal) tidak bisa mengubah jawaban
+            key = (goal, hash(current_observation))
+            if key in self._goal_cache:
+                return self._goal_cache[key]
+            
             prompt = f"""
 Goal: {goal}
 
@@ -228,10 +299,15 @@ Has the goal been achieved? Respond with only "YES" or "NO".
 """
             
             response = await self.llm.generate_response(prompt)
-            return "YES" in response.upper()
+            achieved = "YES" in response.upper()
+            
+            if len(self._goal_cache) >= GOAL_CACHE_SIZE:
+                self._goal_cache.clear()
+            self._goal_cache[key] = achieved
+            return achieved
         
         except Exception as e:
-            print(f"Goal check failed: {e}")
+            logger.warning("Goal check failed: %s", e)
             return False
     
     async def get_status(self) -> Dict[str, Any]:
@@ -257,7 +333,7 @@ Has the goal been achieved? Respond with only "YES" or "NO".
         try:
             if self.browser_manager:
                 await self.browser_manager.close()
-            print("Agent orchestrator cleaned up successfully")
+            logger.info("Agent orchestrator cleaned up successfully")
         except Exception as e:
-            print(f"Cleanup error: {e}")
+            logger.warning("Cleanup error: %s", e)
 
@@ -5,8 +5,37 @@ import asyncio
 import time
 from typing import Dict, Any, Optional
 from abc import ABC, abstractmethod
-from playwright.async_api import async_playwright, Browser, Page
-from bs4 import BeautifulSoup
+from playwright.async_api import async_playwright, Browser, Page, TimeoutError as PlaywrightTimeoutError
+from agent.browser_manager import INTERACTIVE_SCRIPT
+
+# Extract url, title, text preview, dan interactive elements di browser. Elements memakai
+# scanner yang sama dengan step observation (window.__getInteractive dari init script
+# BrowserManager), di-inline untuk page tanpa init script, jadi selector-nya selalu sama.
+JS_EXTRACT = """
+() => {
+    const scan = window.__getInteractive || (""" + INTERACTIVE_SCRIPT.strip() + """);
+    // Text dari main content jika ada; textContent sebagai fallback kalau innerText kosong
+    const root = document.querySelector('main, [role="main"]') || document.body;
+    const text = root ? (root.innerText || root.textContent || '').trim() : '';
+    
+    return {
+        url: location.href,
+        title: document.title,
+        text: text.slice(0, 500),
+        text_length: text.length,
+        interactive: scan()
+    };
+}
+"""
+
+# Parameter per tool, dipakai untuk manifest di planning prompt
+TOOL_PARAMETERS = {
+    "navigate": "url",
+    "click": "selector",
+    "type": "selector, text",
+    "read_dom": "",
+    "wait": "seconds"
+}
 
 class Tool(ABC):
     """Abstract base class untuk tools"""
@@ -32,11 +61,9 @@ class NavigateTool(BrowserTool):
             if not self.page:
                 raise Exception("Browser page not initialized")
             
+            # DOMContentLoaded cukup untuk read_dom; networkidle jarang tercapai di halaman berat
             await self.page.goto(url, wait_until="domcontentloaded")
             
-            # Wait for page to load
-            await self.page.wait_for_load_state("networkidle", timeout=10000)
-            
             current_url = self.page.url
             title = await self.page.title()
             
@@ -66,11 +93,16 @@ class ClickTool(BrowserTool):
             # Wait for element to be visible
             await self.page.wait_for_selector(selector, timeout=10000)
             
-            # Click element
-            await self.page.click(selector)
-            
-            # Wait a bit for any page changes
-            await asyncio.sleep(1)
+            # Click element, lalu tunggu navigasi yang dipicu click (maks 2 detik);
+            # click tanpa navigasi cukup menunggu timeout tersebut habis
+            clicked = False
+            try:
+                async with self.page.expect_navigation(wait_until="domcontentloaded", timeout=2000):
+                    await self.page.click(selector)
+                    clicked = True
+            except PlaywrightTimeoutError:
+                if not clicked:
+                    raise
             
             return {
                 "success": True,
@@ -122,67 +154,32 @@ class ReadDOMTool(BrowserTool):
             if not self.page:
                 raise Exception("Browser page not initialized")
             
-            # Get page content
-            content = await self.page.content()
-            current_url = self.page.url
-            title = await self.page.title()
-            
-            # Parse dengan BeautifulSoup untuk summarization
-            soup = BeautifulSoup(content, 'html.parser')
+            # Extract semua yang dibutuhkan di browser dalam satu evaluate
+            extracted = await self.page.evaluate(JS_EXTRACT)
+            text_content = extracted["text"]
             
-            # Remove script dan style tags
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Get text content
-            text_content = soup.get_text()
-            
-            # Get interactive elements
+            # Interactive elements dalam format tool (input diberi prefix type)
             interactive_elements = []
-            
-            # Find buttons
-            buttons = soup.find_all(['button', 'input[type="button"]', 'input[type="submit"]'])
-            for btn in buttons[:10]:  # Limit to first 10
-                text = btn.get_text(strip=True) or btn.get('value', '')
-                if text:
+            for element in extracted["interactive"]:
+                if element["type"] == "input":
                     interactive_elements.append({
-                        "type": "button",
-                        "text": text,
-                        "selector": self._generate_selector(btn)
+                        "type": f"input_{element['inputType']}",
+                        "placeholder": element["placeholder"],
+                        "name": element["name"],
+                        "selector": element["selector"]
                     })
-            
-            # Find links
-            links = soup.find_all('a', href=True)
-            for link in links[:10]:  # Limit to first 10
-                text = link.get_text(strip=True)
-                if text:
+                else:
                     interactive_elements.append({
-                        "type": "link",
-                        "text": text,
-                        "href": link['href'],
-                        "selector": self._generate_selector(link)
+                        key: element[key] for key in ("type", "text", "href", "selector") if key in element
                     })
             
-            # Find input fields
-            inputs = soup.find_all(['input', 'textarea'])
-            for inp in inputs[:10]:  # Limit to first 10
-                input_type = inp.get('type', 'text')
-                placeholder = inp.get('placeholder', '')
-                name = inp.get('name', '')
-                interactive_elements.append({
-                    "type": f"input_{input_type}",
-                    "placeholder": placeholder,
-                    "name": name,
-                    "selector": self._generate_selector(inp)
-                })
-            
             # Create summary
             summary = {
-                "url": current_url,
-                "title": title,
-                "text_preview": text_content[:500] + "..." if len(text_content) > 500 else text_content,
+                "url": extracted["url"],
+                "title": extracted["title"],
+                "text_preview": text_content + "..." if extracted["text_length"] > 500 else text_content,
                 "interactive_elements": interactive_elements,
-                "total_text_length": len(text_content)
+                "total_text_length": extracted["text_length"]
             }
             
             return {
@@ -194,27 +191,6 @@ class ReadDOMTool(BrowserTool):
                 "success": False,
                 "error": str(e)
             }
-    
-    def _generate_selector(self, element) -> str:
-        """Generate CSS selector untuk element"""
-        # Simple selector generation
-        tag = element.name
-        
-        # Try ID first
-        if element.get('id'):
-            return f"#{element['id']}"
-        
-        # Try class
-        if element.get('class'):
-            classes = ' '.join(element['class'])
-            return f"{tag}.{classes.replace(' ', '.')}"
-        
-        # Try name
-        if element.get('name'):
-            return f"{tag}[name='{element['name']}']"
-        
-        # Fallback to tag
-        return tag
 
 class WaitTool(Tool):
     """Tool untuk wait/delay"""
@@ -250,6 +226,9 @@ class Toolset:
             "read_dom": ReadDOMTool(browser, page),
             "wait": WaitTool()
         }
+        
+        # Bound execute method per tool, di-resolve sekali
+        self._tool_exec = {name: tool.execute for name, tool in self.tools.items()}
     
     def update_browser_context(self, browser: Browser, page: Page):
         """Update browser context untuk semua browser tools"""
@@ -263,14 +242,14 @@ class Toolset:
     
     async def execute_tool(self, tool_name: str, **parameters) -> Dict[str, Any]:
         """Execute tool dengan nama dan parameters"""
-        if tool_name not in self.tools:
+        execute = self._tool_exec.get(tool_name)
+        if execute is None:
             return {
                 "success": False,
                 "error": f"Unknown tool: {tool_name}"
             }
         
-        tool = self.tools[tool_name]
-        return await tool.execute(**parameters)
+        return await execute(**parameters)
     
     def get_available_tools(self) -> Dict[str, str]:
         """Get list of available tools"""
@@ -281,4 +260,10 @@ class Toolset:
             "read_dom": "Read current page DOM",
             "wait": "Wait for specified seconds"
         }
-
+    
+    def get_tool_manifest(self) -> Dict[str, str]:
+        """Get tool signatures (dengan parameter) dan deskripsinya untuk planning prompt"""
+        return {
+            f"{name}({TOOL_PARAMETERS.get(name, '')})": description
+            for name, description in self.get_available_tools().items()
+        }
@@ -5,6 +5,12 @@ import asyncio
 import os
 from agent.orchestrator import AgentOrchestrator
 from agent.models import AgentRequest
+from agent.browser_manager import shutdown_shared_browser
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 async def demo_web_search():
     """Demo: Search di Google dan baca hasil"""
@@ -126,9 +132,14 @@ async def main():
         
         print("\\n" + "-" * 50)
     
+    await shutdown_shared_browser()
+    
     print("\\n🎉 All demos completed!")
     print("\\nNote: For full LLM-powered demos, set OPENAI_API_KEY environment variable.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
 
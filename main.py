@@ -3,20 +3,37 @@ Autonomous Agent - Main Application
 """
 import os
 import asyncio
+import logging
+import logging.handlers
+import queue
+from contextlib import aclosing
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
+import orjson
 import uvicorn
 
 from agent.orchestrator import AgentOrchestrator
-from agent.models import AgentRequest, AgentResponse
+from agent.models import AgentRequest, AgentResponse, AgentStep
+from agent.browser_manager import MAX_BROWSER_CONTEXTS, start_shared_browser, shutdown_shared_browser
+
+# Logging lewat queue: handler di event loop hanya enqueue, thread listener yang menulis ke stderr
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_queue_handler])
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Autonomous Agent API",
     description="API untuk agent otomatis dengan kemampuan browser automation",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -28,14 +45,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize agent orchestrator
-orchestrator: Optional[AgentOrchestrator] = None
+# Jumlah task yang boleh berjalan bersamaan (satu orchestrator + browser context per task)
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "4"))
+
+# Pool orchestrator: queue berisi instance yang idle
+orchestrators: List[AgentOrchestrator] = []
+pool: Optional["asyncio.Queue[AgentOrchestrator]"] = None
 
 @app.on_event("startup")
 async def startup_event():
-    global orchestrator
-    orchestrator = AgentOrchestrator()
-    await orchestrator.initialize()
+    global pool
+    _log_listener.start()
+    
+    # Coroutine yang selesai tanpa suspend tidak perlu lewat event loop (Python 3.12+)
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    
+    # Setiap orchestrator memegang satu context slot selama hidup; tanpa slot yang cukup
+    # initialize() pool akan menunggu selamanya
+    if MAX_CONCURRENCY > MAX_BROWSER_CONTEXTS:
+        raise RuntimeError(
+            f"MAX_CONCURRENCY ({MAX_CONCURRENCY}) must not exceed MAX_BROWSER_CONTEXTS ({MAX_BROWSER_CONTEXTS})"
+        )
+    
+    # Launch browser sekali; setiap orchestrator hanya membuat context di atasnya
+    await start_shared_browser()
+    
+    instances = [AgentOrchestrator() for _ in range(MAX_CONCURRENCY)]
+    await asyncio.gather(*(instance.initialize() for instance in instances))
+    
+    idle: "asyncio.Queue[AgentOrchestrator]" = asyncio.Queue(maxsize=MAX_CONCURRENCY)
+    for instance in instances:
+        idle.put_nowait(instance)
+    orchestrators.extend(instances)
+    pool = idle
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await asyncio.gather(*(instance.cleanup() for instance in orchestrators))
+    await shutdown_shared_browser()
+    _log_listener.stop()
 
 @app.get("/")
 async def root():
@@ -45,27 +94,65 @@ async def root():
 @app.post("/agent/execute", response_model=AgentResponse)
 async def execute_agent_task(request: AgentRequest):
     """Execute agent task"""
-    if orchestrator is None:
+    if pool is None:
         raise HTTPException(status_code=503, detail="Agent orchestrator not initialized. Please wait a moment and try again.")
+    # Tunggu sampai ada orchestrator idle; dikembalikan ke pool setelah selesai
+    orchestrator = await pool.get()
     try:
         result = await orchestrator.execute_task(request)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        pool.put_nowait(orchestrator)
+
+@app.post("/agent/execute/stream")
+async def stream_agent_task(request: AgentRequest):
+    """Execute agent task, stream setiap step sebagai Server-Sent Events"""
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Agent orchestrator not initialized. Please wait a moment and try again.")
+    
+    async def events() -> AsyncIterator[bytes]:
+        # Ambil orchestrator di dalam body iterator: kalau client disconnect sebelum
+        # iterator mulai, Starlette tidak pernah menjalankan finally di bawah
+        orchestrator = await pool.get()
+        try:
+            # aclosing: finally di stream_task harus selesai sebelum orchestrator kembali ke pool
+            async with aclosing(orchestrator.stream_task(request)) as stream:
+                async for event in stream:
+                    if isinstance(event, AgentStep):
+                        yield b"event: step\ndata: " + orjson.dumps(event.model_dump(mode="json")) + b"\n\n"
+                    else:
+                        # Steps sudah dikirim satu per satu
+                        yield b"event: done\ndata: " + orjson.dumps(event.model_dump(mode="json", exclude={"steps"})) + b"\n\n"
+        finally:
+            pool.put_nowait(orchestrator)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @app.get("/agent/status")
 async def get_agent_status():
     """Get current agent status"""
-    if orchestrator is None:
+    if pool is None:
         raise HTTPException(status_code=503, detail="Agent orchestrator not initialized. Please wait a moment and try again.")
-    return await orchestrator.get_status()
+    workers = await asyncio.gather(*(instance.get_status() for instance in orchestrators))
+    return {
+        "is_running": any(worker["is_running"] for worker in workers),
+        "max_concurrency": MAX_CONCURRENCY,
+        "idle_workers": pool.qsize(),
+        "workers": workers
+    }
 
 @app.post("/agent/stop")
 async def stop_agent():
-    """Stop current agent task"""
-    if orchestrator is None:
+    """Stop current agent tasks"""
+    if pool is None:
         raise HTTPException(status_code=503, detail="Agent orchestrator not initialized. Please wait a moment and try again.")
-    return await orchestrator.stop_current_task()
+    results = await asyncio.gather(*(instance.stop_current_task() for instance in orchestrators))
+    stopped = sum(result["message"] == "Task stopped successfully" for result in results)
+    if stopped:
+        return {"message": f"{stopped} task(s) stopped successfully"}
+    return {"message": "No task is currently running"}
 
 if __name__ == "__main__":
     uvicorn.run(
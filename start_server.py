@@ -5,16 +5,32 @@ import os
 import uvicorn
 from main import app
 
+try:
+    import uvloop  # noqa: F401
+    EVENT_LOOP = "uvloop"
+except ImportError:
+    EVENT_LOOP = "asyncio"
+
+try:
+    import httptools  # noqa: F401
+    HTTP_PROTOCOL = "httptools"
+except ImportError:
+    HTTP_PROTOCOL = "h11"
+
 if __name__ == "__main__":
     # Set default environment variables
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
     debug = os.getenv("DEBUG", "false").lower() == "true"
+    # Setiap worker punya browser dan orchestrator pool sendiri, dan /agent/status dan
+    # /agent/stop hanya melihat worker yang menerima request -> default 1 worker
+    workers = 1 if debug else int(os.getenv("WORKERS", "1"))
     
     print(f"🤖 Starting Autonomous Agent Server...")
     print(f"📡 Host: {host}")
     print(f"🔌 Port: {port}")
     print(f"🐛 Debug: {debug}")
+    print(f"👷 Workers: {workers}")
     print(f"🌐 URL: http://{host}:{port}")
     print("=" * 50)
     
@@ -23,6 +39,9 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=debug,
+        workers=workers,
+        loop=EVENT_LOOP,
+        http=HTTP_PROTOCOL,
         log_level="info" if not debug else "debug"
     )
 
@@ -1,224 +1,409 @@
 """
 Test script untuk Autonomous Agent
 """
+import argparse
 import asyncio
+import cProfile
+import io
+import logging
 import os
+import pstats
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Final, List, Optional, Tuple
 from agent.orchestrator import AgentOrchestrator
-from agent.models import AgentRequest
+from agent.models import AgentRequest, AgentResponse
+from agent.browser_manager import BrowserManager, start_shared_browser, shutdown_shared_browser
+from agent.toolset import Toolset
 
-async def test_basic_functionality():
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Output di-buffer di memory dan ditulis sekali di akhir main()
+_log_buffer = io.StringIO()
+logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(_log_buffer)], format="%(message)s")
+logger = logging.getLogger(__name__)
+
+# Set dummy API key untuk testing (jika tidak ada), sekali saat import
+DUMMY_API_KEY: Final[str] = "dummy-key-for-testing"
+os.environ.setdefault("OPENAI_API_KEY", DUMMY_API_KEY)
+
+# Tanpa API key asli, pakai mock LLM (deterministic, tanpa network call ke OpenAI)
+LLM_PROVIDER: Final[str] = "mock" if os.environ["OPENAI_API_KEY"] == DUMMY_API_KEY else "openai"
+
+# Status akhir yang dianggap valid untuk test (keduanya acceptable)
+_ACCEPT_STATUSES: Final[frozenset] = frozenset({"completed", "failed"})
+
+# Chromium launch args ramping untuk CI container (Linux); platform lain pakai default
+CI_LAUNCH_ARGS: Final[Optional[List[str]]] = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--no-zygote"
+] if sys.platform.startswith("linux") else None
+
+# Batas waktu per test (detik) supaya browser/LLM yang hang tidak memblokir run
+BROWSER_TEST_TIMEOUT: Final[float] = 30.0
+AGENT_TEST_TIMEOUT: Final[float] = 90.0
+
+# Orchestrator di-share antar test dalam satu run, dibuat sekali secara lazy
+_orchestrator: Optional[AgentOrchestrator] = None
+_orchestrator_lock = asyncio.Lock()
+
+async def get_orchestrator() -> Optional[AgentOrchestrator]:
+    """Get shared orchestrator, initialize saat pertama kali dipanggil"""
+    global _orchestrator
+    async with _orchestrator_lock:
+        if _orchestrator is None:
+            orchestrator = AgentOrchestrator(
+                llm_provider=LLM_PROVIDER,
+                browser_type="chromium",
+                headless=True,
+                launch_args=CI_LAUNCH_ARGS
+            )
+            logger.info("Initializing agent...")
+            if not await orchestrator.initialize():
+                return None
+            _orchestrator = orchestrator
+        return _orchestrator
+
+async def close_orchestrator() -> None:
+    """Cleanup shared orchestrator (sekali, di akhir main)"""
+    global _orchestrator
+    if _orchestrator is not None:
+        await _orchestrator.cleanup()
+        _orchestrator = None
+
+async def test_basic_functionality() -> bool:
     """Test basic functionality dari agent"""
-    print("=== Testing Basic Agent Functionality ===")
-    
-    # Set dummy API key untuk testing (jika tidak ada)
-    if not os.getenv("OPENAI_API_KEY"):
-        os.environ["OPENAI_API_KEY"] = "dummy-key-for-testing"
-    
-    # Initialize orchestrator
-    orchestrator = AgentOrchestrator(
-        llm_provider="openai",
-        browser_type="chromium",
-        headless=True
-    )
+    logger.info("=== Testing Basic Agent Functionality ===")
     
     try:
-        # Initialize
-        print("Initializing agent...")
-        success = await orchestrator.initialize()
-        if not success:
-            print("❌ Failed to initialize agent")
+        orchestrator = await get_orchestrator()
+        if orchestrator is None:
+            logger.error("❌ Failed to initialize agent")
             return False
         
-        print("✅ Agent initialized successfully")
+        logger.info("✅ Agent initialized successfully")
         
         # Test browser navigation
-        print("\\nTesting browser navigation...")
+        logger.info("\nTesting browser navigation...")
         request = AgentRequest(
             goal="Navigate to example.com and read the page content",
             max_iterations=3
         )
         
-        response = await orchestrator.execute_task(request)
+        response: AgentResponse = await orchestrator.execute_task(request)
         
-        print(f"Task Status: {response.status}")
-        print(f"Steps Executed: {len(response.steps)}")
-        print(f"Execution Time: {response.execution_time:.2f}s")
+        logger.info("Task Status: %s", response.status)
+        logger.info("Steps Executed: %d", len(response.steps))
+        logger.info("Execution Time: %.2fs", response.execution_time)
         
         if response.steps:
-            print("\\nStep Details:")
+            logger.info("\nStep Details:")
             for step in response.steps:
-                print(f"  Step {step.step_number}: {step.tool_call.tool_name}")
-                print(f"    Success: {step.success}")
+                logger.info("  Step %d: %s", step.step_number, step.tool_call.tool_name)
+                logger.info("    Success: %s", step.success)
                 if step.tool_call.error:
-                    print(f"    Error: {step.tool_call.error}")
+                    logger.info("    Error: %s", step.tool_call.error)
+        
+        # Mock LLM deterministic: step pertama harus navigate dan goal tercapai
+        if LLM_PROVIDER == "mock":
+            return (
+                response.status == "completed"
+                and bool(response.steps)
+                and response.steps[0].tool_call.tool_name == "navigate"
+            )
         
-        return response.status in ["completed", "failed"]  # Either is acceptable for testing
+        return response.status in _ACCEPT_STATUSES
         
     except Exception as e:
-        print(f"❌ Test failed with error: {e}")
+        logger.error("❌ Test failed with error: %s", e)
+        return False
+
+async def test_stream_disconnect() -> bool:
+    """Client yang disconnect sebelum chunk SSE pertama tidak boleh menghabiskan pool orchestrator"""
+    logger.info("\n=== Testing Stream Disconnect ===")
+    
+    import main as server
+    
+    class FakeOrchestrator:
+        async def stream_task(self, request: AgentRequest) -> AsyncIterator[AgentResponse]:
+            yield AgentResponse(task_id="fake", goal=request.goal, status="completed", steps=[])
+    
+    body = b'{"goal": "disconnect test"}'
+    messages = [
+        {"type": "http.request", "body": body, "more_body": False},
+        {"type": "http.disconnect"}
+    ]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/agent/execute/stream", "raw_path": b"/agent/execute/stream",
+        "root_path": "", "query_string": b"", "server": ("test", 80), "client": ("test", 1234),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    }
+    
+    async def receive() -> Dict[str, Any]:
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+    
+    async def send(message: Dict[str, Any]) -> None:
+        # Checkpoint seperti transport asli; disconnect dibatalkan setelah http.response.start
+        await asyncio.sleep(0)
+    
+    previous_pool = server.pool
+    server.pool = asyncio.Queue()
+    server.pool.put_nowait(FakeOrchestrator())
+    try:
+        await server.app(scope, receive, send)
+        # Beri kesempatan async generator yang ditinggal untuk di-finalize
+        await asyncio.sleep(0.05)
+        idle = server.pool.qsize()
+    except Exception as e:
+        logger.error("❌ Stream disconnect test failed: %s", e)
         return False
+    finally:
+        server.pool = previous_pool
     
+    if idle != 1:
+        logger.error("❌ Orchestrator not returned to pool after disconnect (idle=%d)", idle)
+        return False
+    logger.info("✅ Orchestrator returned to pool after disconnect")
+    return True
+
+@asynccontextmanager
+async def shared_browser() -> AsyncIterator[BrowserManager]:
+    """Satu BrowserManager yang dipakai bersama oleh test browser dan toolset
+    
+    Context dan page yang sama dipakai ulang, jadi cookies dan koneksi ke
+    example.com dari test pertama langsung dipakai test berikutnya.
+    """
+    browser_manager = BrowserManager(headless=True, launch_args=CI_LAUNCH_ARGS)
+    logger.info("Initializing browser...")
+    try:
+        await asyncio.wait_for(browser_manager.initialize(), timeout=BROWSER_TEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Browser initialization TIMEOUT after %ss", BROWSER_TEST_TIMEOUT)
+    try:
+        yield browser_manager
     finally:
-        # Cleanup
-        await orchestrator.cleanup()
+        await browser_manager.close()
 
-async def test_browser_manager():
+async def test_browser_manager(browser_manager: BrowserManager) -> bool:
     """Test browser manager secara terpisah"""
-    print("\\n=== Testing Browser Manager ===")
-    
-    from agent.browser_manager import BrowserManager
-    
-    browser_manager = BrowserManager(headless=True)
+    logger.info("\n=== Testing Browser Manager ===")
     
     try:
-        # Initialize
-        print("Initializing browser...")
-        success = await browser_manager.initialize()
-        if not success:
-            print("❌ Failed to initialize browser")
+        if not browser_manager.page:
+            logger.error("❌ Failed to initialize browser")
             return False
         
-        print("✅ Browser initialized successfully")
+        logger.info("✅ Browser initialized successfully")
         
         # Test navigation
-        print("Testing navigation to example.com...")
-        result = await browser_manager.navigate("https://example.com")
+        logger.info("Testing navigation to example.com...")
+        result: Dict[str, Any] = await browser_manager.navigate("https://example.com")
         
         if result.get('success'):
-            print(f"✅ Navigation successful: {result.get('title')}")
+            logger.info("✅ Navigation successful: %s", result.get('title'))
         else:
-            print(f"❌ Navigation failed: {result.get('error')}")
+            logger.error("❌ Navigation failed: %s", result.get('error'))
             return False
         
         # Test DOM reading
-        print("Testing DOM reading...")
+        logger.info("Testing DOM reading...")
         content_result = await browser_manager.get_page_content()
         
         if content_result.get('success'):
-            content = content_result.get('content', '')
-            print(f"✅ DOM reading successful: {len(content)} characters")
+            content: str = content_result.get('content', '')
+            logger.info("✅ DOM reading successful: %d characters", len(content))
         else:
-            print(f"❌ DOM reading failed: {content_result.get('error')}")
+            logger.error("❌ DOM reading failed: %s", content_result.get('error'))
             return False
         
         return True
         
     except Exception as e:
-        print(f"❌ Browser test failed: {e}")
+        logger.error("❌ Browser test failed: %s", e)
         return False
-    
-    finally:
-        await browser_manager.close()
 
-async def test_toolset():
+async def test_toolset(browser_manager: BrowserManager) -> bool:
     """Test toolset secara terpisah"""
-    print("\\n=== Testing Toolset ===")
-    
-    from agent.toolset import Toolset
-    from agent.browser_manager import BrowserManager
-    
-    browser_manager = BrowserManager(headless=True)
+    logger.info("\n=== Testing Toolset ===")
     
     try:
-        # Initialize browser
-        await browser_manager.initialize()
-        
         # Initialize toolset
         toolset = Toolset(browser_manager.browser, browser_manager.page)
         
         # Test available tools
         available_tools = toolset.get_available_tools()
-        print(f"Available tools: {list(available_tools.keys())}")
+        logger.info("Available tools: %s", list(available_tools.keys()))
         
         # Test navigate tool
-        print("Testing navigate tool...")
-        result = await toolset.execute_tool("navigate", url="https://example.com")
+        logger.info("Testing navigate tool...")
+        result: Dict[str, Any] = await toolset.execute_tool("navigate", url="https://example.com")
         
         if result.get('success'):
-            print("✅ Navigate tool successful")
+            logger.info("✅ Navigate tool successful")
         else:
-            print(f"❌ Navigate tool failed: {result.get('error')}")
+            logger.error("❌ Navigate tool failed: %s", result.get('error'))
             return False
         
-        # Test read_dom tool
-        print("Testing read_dom tool...")
-        result = await toolset.execute_tool("read_dom")
+        # Test read_dom dan wait tool bersamaan (read_dom hanya membaca page, wait tidak menyentuh page)
+        # (wait: yang dites dispatch-nya, bukan durasinya)
+        logger.info("Testing read_dom and wait tools...")
+        dom_result, wait_result = await asyncio.gather(
+            toolset.execute_tool("read_dom"),
+            toolset.execute_tool("wait", seconds=0.05)
+        )
         
-        if result.get('success'):
-            dom_result = result.get('result', {})
-            print(f"✅ Read DOM successful: {dom_result.get('title', 'No title')}")
+        if dom_result.get('success'):
+            dom_summary = dom_result.get('result', {})
+            logger.info("✅ Read DOM successful: %s", dom_summary.get('title', 'No title'))
         else:
-            print(f"❌ Read DOM failed: {result.get('error')}")
+            logger.error("❌ Read DOM failed: %s", dom_result.get('error'))
             return False
         
-        # Test wait tool
-        print("Testing wait tool...")
-        result = await toolset.execute_tool("wait", seconds=1)
-        
-        if result.get('success'):
-            print("✅ Wait tool successful")
+        if wait_result.get('success'):
+            logger.info("✅ Wait tool successful")
         else:
-            print(f"❌ Wait tool failed: {result.get('error')}")
+            logger.error("❌ Wait tool failed: %s", wait_result.get('error'))
             return False
         
         return True
         
     except Exception as e:
-        print(f"❌ Toolset test failed: {e}")
+        logger.error("❌ Toolset test failed: %s", e)
         return False
-    
-    finally:
-        await browser_manager.close()
 
-async def main():
+def _task_result(task: "asyncio.Task[Any]", default: Any) -> Any:
+    """Hasil task, atau default jika task gagal atau dibatalkan"""
+    if task.cancelled() or task.exception() is not None:
+        return default
+    return task.result()
+
+async def main() -> None:
     """Main test function"""
-    print("Starting Autonomous Agent Tests...")
-    
-    tests = [
-        ("Browser Manager", test_browser_manager),
-        ("Toolset", test_toolset),
-        ("Basic Functionality", test_basic_functionality)
-    ]
-    
-    results = []
-    
-    for test_name, test_func in tests:
-        print(f"\\n{'='*50}")
-        print(f"Running {test_name} Test")
-        print('='*50)
+    try:
+        logger.info("Starting Autonomous Agent Tests...")
         
-        try:
-            result = await test_func()
-            results.append((test_name, result))
+        async def run_test(test_name: str, test_func: Callable[[], Awaitable[bool]], timeout: float) -> Tuple[str, bool]:
+            logger.info("\n%s", '='*50)
+            logger.info("Running %s Test", test_name)
+            logger.info('='*50)
             
-            if result:
-                print(f"✅ {test_name} test PASSED")
-            else:
-                print(f"❌ {test_name} test FAILED")
+            try:
+                result = await asyncio.wait_for(test_func(), timeout=timeout)
+                
+                if result:
+                    logger.info("✅ %s test PASSED", test_name)
+                else:
+                    logger.error("❌ %s test FAILED", test_name)
+                return (test_name, result)
+            
+            except asyncio.TimeoutError:
+                logger.error("❌ %s test TIMEOUT after %ss", test_name, timeout)
+                return (test_name, False)
+            
+            except Exception as e:
+                logger.error("❌ %s test CRASHED: %s", test_name, e)
+                return (test_name, False)
         
+        async def run_browser_tests() -> List[Tuple[str, bool]]:
+            async with shared_browser() as browser_manager:
+                # Kedua test memakai page yang sama -> berurutan
+                return [
+                    await run_test("Browser Manager", lambda: test_browser_manager(browser_manager), BROWSER_TEST_TIMEOUT),
+                    await run_test("Toolset", lambda: test_toolset(browser_manager), BROWSER_TEST_TIMEOUT)
+                ]
+        
+        # Start Playwright driver + shared browser sekali sebelum test, supaya cost startup
+        # tidak ditagihkan ke test pertama dan test tidak berebut launch
+        try:
+            await asyncio.wait_for(start_shared_browser(launch_args=CI_LAUNCH_ARGS), timeout=BROWSER_TEST_TIMEOUT)
         except Exception as e:
-            print(f"❌ {test_name} test CRASHED: {e}")
-            results.append((test_name, False))
-    
-    # Summary
-    print(f"\\n{'='*50}")
-    print("TEST SUMMARY")
-    print('='*50)
-    
-    passed = sum(1 for _, result in results if result)
-    total = len(results)
-    
-    for test_name, result in results:
-        status = "✅ PASSED" if result else "❌ FAILED"
-        print(f"{test_name}: {status}")
+            logger.error("Browser warmup failed: %s", e)
+        
+        # Browser tests dan orchestrator test independen -> jalankan bersamaan
+        browser_failed: List[Tuple[str, bool]] = [("Browser Manager", False), ("Toolset", False)]
+        # Structured concurrency: semua task ditunggu, error dikumpulkan di ExceptionGroup
+        try:
+            async with asyncio.TaskGroup() as tg:
+                browser_task = tg.create_task(run_browser_tests())
+                basic_task = tg.create_task(
+                    run_test("Basic Functionality", test_basic_functionality, AGENT_TEST_TIMEOUT)
+                )
+                stream_task = tg.create_task(
+                    run_test("Stream Disconnect", test_stream_disconnect, BROWSER_TEST_TIMEOUT)
+                )
+        except* Exception as group:
+            for error in group.exceptions:
+                logger.error("❌ Test task CRASHED: %s", error)
+        browser_results = _task_result(browser_task, browser_failed)
+        basic_result = _task_result(basic_task, ("Basic Functionality", False))
+        stream_result = _task_result(stream_task, ("Stream Disconnect", False))
+        results: List[Tuple[str, bool]] = [*browser_results, basic_result, stream_result]
+        
+        # Summary, dirakit lalu ditulis sekali
+        lines: List[str] = [f"\n{'='*50}", "TEST SUMMARY", '='*50]
+        passed: int = 0
+        total: int = len(results)
+        
+        # Hitung passed sekaligus saat menulis status
+        for test_name, result in results:
+            lines.append(f"{test_name}: {'✅ PASSED' if result else '❌ FAILED'}")
+            passed += bool(result)
+        
+        lines.append(f"\nOverall: {passed}/{total} tests passed")
+        
+        if passed == total:
+            lines.append("🎉 All tests passed! Agent is ready for use.")
+        else:
+            lines.append("⚠️  Some tests failed. Please check the implementation.")
+        logger.info("\n".join(lines))
+        
+        await close_orchestrator()
+        await shutdown_shared_browser()
+    finally:
+        sys.stdout.write(_log_buffer.getvalue())
+        _log_buffer.seek(0)
+        _log_buffer.truncate()
+
+def run_main() -> None:
+    """Jalankan main() di asyncio.Runner baru, dengan uvloop jika tersedia"""
+    loop_factory = uvloop.new_event_loop if uvloop is not None else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
+
+def run_profiled(output: str) -> None:
+    """Jalankan main() di bawah cProfile dan simpan stats
     
-    print(f"\\nOverall: {passed}/{total} tests passed")
+    Tidak ada gate otomatis: total waktu run didominasi launch Chromium, network, dan
+    idle di event loop. Yang dicetak adalah own time fungsi agent untuk dibandingkan manual.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run_main()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output)
     
-    if passed == total:
-        print("🎉 All tests passed! Agent is ready for use.")
-    else:
-        print("⚠️  Some tests failed. Please check the implementation.")
+    stats = pstats.Stats(profiler)
+    stats.sort_stats("tottime").print_stats(r"agent[/\\]", 20)
+    print(f"Profile saved to {output}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Autonomous Agent smoke tests")
+    parser.add_argument("--profile", nargs="?", const="prof.pstat", metavar="PSTAT",
+                        help="Profile dengan cProfile dan simpan stats (default: prof.pstat)")
+    args = parser.parse_args()
+    
+    if args.profile:
+        run_profiled(args.profile)
+    else:
+        run_main()
 